@@ -1,30 +1,251 @@
-import json
+import orjson
 import boto3
 import os
-import urllib.request
+import re
+import hashlib
+import traceback
+import unicodedata
+import urllib3
 import numpy as np 
 from io import BytesIO
+from pyroaring import BitMap
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 
-s3 = boto3.client('s3')
-papers_cache = None
+# Keep S3 connections alive across warm invocations and back off on throttling
+s3 = boto3.client('s3', config=Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 3}
+))
 
-def load_papers():
-    global papers_cache
-    if papers_cache is None:
-        try:
-            bucket = 'research-paper-rec'
-            obj = s3.get_object(Bucket=bucket, Key='data/processed/papers_sample_10k.json')
-            lines = obj['Body'].read().decode('utf-8').split('\n')
-            papers_cache = [json.loads(line) for line in lines if line.strip()]
-            print(f"Loaded {len(papers_cache)} papers")
-        except Exception as e:
-            print(f"Error: {e}")
-            papers_cache = []
-    return papers_cache
+BUCKET = 'research-paper-rec'
+PAPERS_KEY = 'data/processed/papers_sample_10k.json'
+
+# Longer questions are cut off before embedding and prompting
+MAX_QUERY_CHARS = 500
+# Most queries search_papers will embed and score in one request
+MAX_BATCH_QUERIES = 20
+# Largest top_k search_papers will return per query
+MAX_TOP_K = 50
+# Most papers batch_explain will submit in one Gemini batch job
+MAX_BATCH_PAPERS = 100
+# Gemini batch resource names, as returned by batch_explain
+BATCH_NAME_RE = re.compile(r'batches/[A-Za-z0-9_-]+')
+# batch_explain labels its jobs with this display name and keys each
+# request p_<paper index>
+EXPLAIN_BATCH_DISPLAY_NAME = 'explain-papers'
+EXPLAIN_BATCH_KEY_RE = re.compile(r'p_(\d+)')
+
+# Paper fields are packed per field into one UTF-8 blob plus an offsets array
+# (paper i is blob[offsets[i]:offsets[i + 1]]), so the corpus is a handful of
+# buffers rather than tens of thousands of str objects. Read via _text_at().
+# Prompts use at most ABSTRACT_CHARS of an abstract, so only that much is kept.
+ABSTRACT_CHARS = 500
+paper_count = 0
+titles = (b'', np.zeros(1, dtype=np.int64))
+abstracts = (b'', np.zeros(1, dtype=np.int64))
+abstracts_short = (b'', np.zeros(1, dtype=np.int64))
+
+def _pack(texts):
+    encoded = [t.encode('utf-8') for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return b''.join(encoded), offsets
+
+def _text_at(packed, idx):
+    blob, offsets = packed
+    return blob[offsets[idx]:offsets[idx + 1]].decode('utf-8')
+
+# Inverted index for keyword_search: token -> roaring bitmap of paper indices.
+# abstract_postings only lists papers whose title lacks the token, so a
+# paper is credited once per query word (title beats abstract).
+WORD_RE = re.compile(r'[a-z0-9]+')
+title_postings = {}
+abstract_postings = {}
+
+# Popular queries repeat across warm invocations, so keep their token tuples
+@lru_cache(maxsize=1024)
+def _tokenize(text):
+    return tuple(WORD_RE.findall(text.lower()))
+
+# Every index token, '\0'-separated, so keyword_search can find the tokens
+# containing a query word with one regex scan in C. Query words are
+# [a-z0-9]+, so a word occurs in a text exactly when it occurs in one of the
+# text's tokens: expanding it to those tokens keeps plain substring semantics.
+vocabulary = '\0'
+
+@lru_cache(maxsize=1024)
+def _matching_tokens(word):
+    return tuple(re.findall(f'(?<=\0)[^\0]*{re.escape(word)}[^\0]*', vocabulary))
+
+def _build_postings(texts):
+    postings = defaultdict(list)
+    for idx, text in enumerate(texts):
+        for token in set(WORD_RE.findall(text)):
+            postings[token].append(idx)
+    return {token: BitMap(ids) for token, ids in postings.items()}
+
+# Like _init_embeddings, any failure propagates and fails the init rather
+# than leaving an empty corpus behind every action
+def _init_papers():
+    global paper_count, titles, abstracts, abstracts_short, title_postings, abstract_postings, vocabulary
+    obj = s3.get_object(Bucket=BUCKET, Key=PAPERS_KEY)
+    lines = obj['Body'].read().split(b'\n')
+    papers = [orjson.loads(line) for line in lines if line.strip()]
+    title_list = [p['title_clean'] for p in papers]
+    abstract_list = [p.get('abstract', '') for p in papers]
+    titles_lower = [t.lower() for t in title_list]
+    abstracts_lower = [a[:2000].lower() for a in abstract_list]
+    titles = _pack(title_list)
+    abstracts = _pack([a[:ABSTRACT_CHARS] for a in abstract_list])
+    # abstract_short is written at ingest; older files fall back to slicing here
+    abstracts_short = _pack([p.get('abstract_short') or a[:300] for p, a in zip(papers, abstract_list)])
+    paper_count = len(papers)
+    title_postings = _build_postings(titles_lower)
+    abstract_postings = {
+        token: ids - title_postings[token] if token in title_postings else ids
+        for token, ids in _build_postings(abstracts_lower).items()
+    }
+    vocabulary = '\0' + '\0'.join(title_postings.keys() | abstract_postings.keys()) + '\0'
+    _matching_tokens.cache_clear()
+    print(f"Loaded {paper_count} papers, {len(title_postings) + len(abstract_postings)} index terms")
+
+# int8 codes + scales (.npz) by default; point at the float16 .npy export
+# instead if int8 recall turns out too lossy for a corpus. Until the int8
+# export has been uploaded, the original float32 embeddings are used.
+EMBEDDINGS_KEY = os.environ.get('EMBEDDINGS_KEY', 'data/embeddings/paper_embeddings_10k_int8.npz')
+FALLBACK_EMBEDDINGS_KEY = 'data/embeddings/paper_embeddings_10k.npy'
+EMBEDDING_CHUNK_ROWS = 1024
+
+# Unit-length rows, written by notebooks/generate_embeddings.ipynb, either as
+# int8 codes with a per-row float32 scale (row ~= codes[i] * scales[i]) or as
+# float16 (normalised on load) with paper_scales left as None
+paper_embeddings = None
+paper_scales = None
+# Reused float32 staging block for the chunked matvec in semantic_search
+_chunk_buffer = None
+
+def _load_embeddings(key):
+    obj = s3.get_object(Bucket=BUCKET, Key=key)
+    if key.endswith('.npz'):
+        with np.load(BytesIO(obj['Body'].read())) as data:
+            return np.ascontiguousarray(data['codes'], dtype=np.int8), data['scales'].astype(np.float32)
+    # Normalise here rather than trusting the file: the raw float32
+    # export is a valid .npy too, and its rows aren't unit length
+    emb = np.load(BytesIO(obj['Body'].read())).astype(np.float32)
+    emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    return np.ascontiguousarray(emb, dtype=np.float16), None
+
+# Error codes S3 returns for an absent key: AccessDenied rather than
+# NoSuchKey when the role lacks s3:ListBucket on the bucket
+MISSING_KEY_CODES = {'NoSuchKey', '404', 'AccessDenied', '403'}
+
+# Any other failure propagates and fails the init, so a broken embeddings
+# setup shows up as Lambda errors instead of silently serving keyword search
+def _init_embeddings():
+    global paper_embeddings, paper_scales, _chunk_buffer
+    try:
+        embeddings, scales = _load_embeddings(EMBEDDINGS_KEY)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in MISSING_KEY_CODES:
+            raise
+        print(f"Warning: {EMBEDDINGS_KEY} unavailable ({e.response['Error']['Code']}), falling back to {FALLBACK_EMBEDDINGS_KEY}")
+        embeddings, scales = _load_embeddings(FALLBACK_EMBEDDINGS_KEY)
+    paper_embeddings, paper_scales = embeddings, scales
+    _chunk_buffer = np.empty((EMBEDDING_CHUNK_ROWS, paper_embeddings.shape[1]), dtype=np.float32)
+    print(f"Loaded embeddings {paper_embeddings.shape} {paper_embeddings.dtype}")
+
+# Runs once per execution environment; warm invocations reuse the arrays.
+# The two S3 objects are independent, so fetch them concurrently.
+with ThreadPoolExecutor(max_workers=2) as executor:
+    for future in [executor.submit(_init_papers), executor.submit(_init_embeddings)]:
+        future.result()
+
+def _gemini_http_error(code):
+    if code == 503:
+        return Exception("The AI service is busy right now. Please wait a moment and try again!")
+    elif code == 429:
+        return Exception("Too many requests. Please wait 30 seconds and try again.")
+    else:
+        return Exception(f"AI service error. Please try again. (Error code: {code})")
+
+# A 200 reply can still lack an answer, e.g. a prompt blocked by the safety
+# filters comes back with only promptFeedback and no candidates
+def _gemini_reply_error(data):
+    try:
+        blocked = bool(orjson.loads(data).get('promptFeedback', {}).get('blockReason'))
+    except (orjson.JSONDecodeError, AttributeError):
+        blocked = False
+    if blocked:
+        return Exception("The AI service declined to answer this request. Please try rephrasing it.")
+    return Exception("Unable to reach AI service. Please check your connection and try again.")
+
+# LRU of recent rag_search answers: hash of (normalised query, source, paper
+# indices) -> (unit query embedding or None, answer, paper_details). The query
+# is only NFKC-normalised and casefolded, never reduced to tokens, so different
+# questions can't share a key. source is how the papers were picked
+# ('relevant_papers', 'semantic' or 'keyword'); each scores them differently,
+# so each gets its own entry. Near-duplicate questions are matched on
+# query-embedding cosine so rephrasings skip the Gemini call too.
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_MIN_SIMILARITY = 0.97
+answer_cache = OrderedDict()
+
+def _cache_key(query, source, indices):
+    normalized = unicodedata.normalize('NFKC', query).casefold().strip() + '|' + source + '|' + ','.join(map(str, indices))
+    return hashlib.blake2b(normalized.encode('utf-8')).digest()
+
+def _cache_get(key):
+    entry = answer_cache.get(key)
+    if entry is not None:
+        answer_cache.move_to_end(key)
+    return entry
+
+def _cache_get_similar(query_embedding):
+    keys = [k for k, v in answer_cache.items() if v[0] is not None]
+    if not keys:
+        return None
+    similarities = np.stack([answer_cache[k][0] for k in keys]) @ query_embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] < ANSWER_CACHE_MIN_SIMILARITY:
+        return None
+    return _cache_get(keys[best])
+
+def _cache_put(key, query_embedding, answer, paper_details):
+    answer_cache[key] = (query_embedding, answer, paper_details)
+    answer_cache.move_to_end(key)
+    if len(answer_cache) > ANSWER_CACHE_SIZE:
+        answer_cache.popitem(last=False)
+
+# Module-scope pool so warm invocations reuse the TLS connections to the
+# Gemini and embedding hosts instead of handshaking on every call.
+http_pool = urllib3.PoolManager(maxsize=8, timeout=urllib3.Timeout(total=30))
+
+# Longest single wait between attempts, for backoff and Retry-After alike
+RETRY_WAIT_MAX = 8
+
+# urllib3 skips the wait before the first retry; this waits 2s, then 4s,
+# like the original retry loop, and caps any Retry-After the server sends
+class _Retry(urllib3.Retry):
+    def get_backoff_time(self):
+        return min(RETRY_WAIT_MAX, self.backoff_factor * 2 ** len(self.history))
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_WAIT_MAX)
+
+# 3 attempts in total
+GEMINI_RETRIES = _Retry(total=2, backoff_factor=1, status_forcelist=[429, 503],
+                        allowed_methods=None, raise_on_status=False)
+EMBEDDING_RETRIES = _Retry(total=2, backoff_factor=1, status_forcelist=[410, 503],
+                           allowed_methods=None, raise_on_status=False)
 
 def call_gemini_api(prompt):
-    import time
     api_key = os.environ.get('GOOGLE_API_KEY')
     
     url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}'
@@ -35,122 +256,199 @@ def call_gemini_api(prompt):
         }]
     }
     
-    max_retries = 3
-    retry_delay = 2
+    try:
+        response = http_pool.request('POST', url, body=orjson.dumps(data),
+                                headers={'Content-Type': 'application/json'}, retries=GEMINI_RETRIES)
+    except urllib3.exceptions.HTTPError:
+        raise Exception("Unable to reach AI service. Please check your connection and try again.")
     
-    for attempt in range(max_retries):
-        try:
-            req = urllib.request.Request(url, data=json.dumps(data).encode('utf-8'), headers={'Content-Type': 'application/json'})
-            
-            with urllib.request.urlopen(req, timeout=30) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result['candidates'][0]['content']['parts'][0]['text']
-                
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            
-            if e.code in [503, 429] and attempt < max_retries - 1:
-                print(f"Retry attempt {attempt + 1}/{max_retries}")
-                time.sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            else:
-                if e.code == 503:
-                    raise Exception("The AI service is busy right now. Please wait a moment and try again!")
-                elif e.code == 429:
-                    raise Exception("Too many requests. Please wait 30 seconds and try again.")
-                else:
-                    raise Exception(f"AI service error. Please try again. (Error code: {e.code})")
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            else:
-                raise Exception("Unable to reach AI service. Please check your connection and try again.")
+    if response.status != 200:
+        raise _gemini_http_error(response.status)
+    
+    try:
+        result = orjson.loads(response.data)
+        return result['candidates'][0]['content']['parts'][0]['text']
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+        raise _gemini_reply_error(response.data)
 
+# Accepts one string or a list of strings; a list is embedded in a single
+# request and comes back as an [M, D] array
 def get_embedding(text):
-    import time
-    
     url = "https://api-inference.huggingface.co/models/sentence-transformers/all-MiniLM-L6-v2"
     
-    data = json.dumps({"inputs": text}).encode('utf-8')
+    data = orjson.dumps({"inputs": text})
     
-    max_retries = 3
-    retry_delay = 2
+    response = http_pool.request('POST', url, body=data,
+                                 headers={'Content-Type': 'application/json'}, retries=EMBEDDING_RETRIES)
     
-    for attempt in range(max_retries):
-        try:
-            req = urllib.request.Request(
-                url, 
-                data=data, 
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            with urllib.request.urlopen(req, timeout=30) as response:
-                result = json.loads(response.read())
-                return np.array(result)
-                
-        except urllib.error.HTTPError as e:
-            if e.code in [503, 410] and attempt < max_retries - 1:
-                print(f"Model loading, retry {attempt + 1}/{max_retries}")
-                time.sleep(retry_delay)
-                retry_delay *= 2
-                continue
-            else:
-                raise Exception(f"Embedding API error: {e.code}")
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
+    if response.status != 200:
+        raise Exception(f"Embedding API error: {response.status}")
+    
+    return np.array(orjson.loads(response.data))
+
+# Gemini Batch API: requests run asynchronously at reduced cost and are
+# polled by batch name, for bulk work that doesn't need an answer right away
+def create_gemini_batch(display_name, keyed_prompts):
+    api_key = os.environ.get('GOOGLE_API_KEY')
+    
+    url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:batchGenerateContent?key={api_key}'
+    
+    data = {
+        "batch": {
+            "display_name": display_name,
+            "input_config": {"requests": {"requests": [
+                {"request": {"contents": [{"parts": [{"text": prompt}]}]}, "metadata": {"key": key}}
+                for key, prompt in keyed_prompts
+            ]}}
+        }
+    }
+    
+    try:
+        response = http_pool.request('POST', url, body=orjson.dumps(data),
+                                     headers={'Content-Type': 'application/json'}, retries=GEMINI_RETRIES)
+    except urllib3.exceptions.HTTPError:
+        raise Exception("Unable to reach AI service. Please check your connection and try again.")
+    
+    if response.status != 200:
+        raise _gemini_http_error(response.status)
+    
+    return orjson.loads(response.data)['name']
+
+# Returns (display_name, state, {key: text}, {key: error message}); results
+# and errors are only filled in once the batch succeeded
+def get_gemini_batch(batch_name):
+    api_key = os.environ.get('GOOGLE_API_KEY')
+    
+    url = f'https://generativelanguage.googleapis.com/v1beta/{batch_name}?key={api_key}'
+    
+    try:
+        response = http_pool.request('GET', url, retries=GEMINI_RETRIES)
+    except urllib3.exceptions.HTTPError:
+        raise Exception("Unable to reach AI service. Please check your connection and try again.")
+    
+    if response.status != 200:
+        raise _gemini_http_error(response.status)
+    
+    batch = orjson.loads(response.data)
+    display_name = batch.get('metadata', {}).get('displayName', '')
+    state = batch.get('metadata', {}).get('state', 'BATCH_STATE_UNSPECIFIED')
+    
+    results = {}
+    errors = {}
+    if state == 'BATCH_STATE_SUCCEEDED':
+        inlined = batch.get('response', {}).get('inlinedResponses', {}).get('inlinedResponses', [])
+        for item in inlined:
+            key = item.get('metadata', {}).get('key')
+            if not key:
                 continue
+            candidates = item.get('response', {}).get('candidates', [])
+            parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+            if parts and 'text' in parts[0]:
+                results[key] = parts[0]['text']
             else:
-                raise
+                errors[key] = item.get('error', {}).get('message', 'No explanation was generated for this paper.')
+    
+    return display_name, state, results, errors
+
+def semantic_search(query_embedding, paper_embeddings, paper_scales=None, top_k=10):
+    return semantic_search_batch([query_embedding], paper_embeddings, paper_scales, top_k)[0]
 
-def semantic_search(query_embedding, paper_embeddings, top_k=10):
-    similarities = np.dot(paper_embeddings, query_embedding) / (
-        np.linalg.norm(paper_embeddings, axis=1) * np.linalg.norm(query_embedding)
-    )
+# Scores M queries in one pass over the corpus: each block is a single BLAS
+# sgemm against all queries instead of M separate sgemv calls
+def semantic_search_batch(query_embeddings, paper_embeddings, paper_scales=None, top_k=10):
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
     
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
+    # Upcast the int8/float16 rows a block at a time into the preallocated
+    # buffer and write each result straight into its rows of similarities.
+    # Callers passing embeddings of another width get a buffer of their own.
+    buffer = _chunk_buffer
+    if buffer is None or buffer.shape[1] != paper_embeddings.shape[1]:
+        buffer = np.empty((EMBEDDING_CHUNK_ROWS, paper_embeddings.shape[1]), dtype=np.float32)
+    similarities = np.empty((len(paper_embeddings), len(queries)), dtype=np.float32)
+    for start in range(0, len(paper_embeddings), EMBEDDING_CHUNK_ROWS):
+        block = paper_embeddings[start:start + EMBEDDING_CHUNK_ROWS]
+        staged = buffer[:len(block)]
+        np.copyto(staged, block, casting='unsafe')
+        np.dot(staged, queries.T, out=similarities[start:start + len(block)])
+    if paper_scales is not None:
+        similarities *= paper_scales[:, None]
     
-    return top_indices.tolist(), similarities[top_indices].tolist()
+    top_k = min(top_k, len(similarities))
+    top_indices = np.argpartition(similarities, -top_k, axis=0)[-top_k:]
+    top_scores = np.take_along_axis(similarities, top_indices, axis=0)
+    order = np.argsort(-top_scores, axis=0)
+    top_indices = np.take_along_axis(top_indices, order, axis=0)
+    top_scores = np.take_along_axis(top_scores, order, axis=0)
+    
+    return [(top_indices[:, j].tolist(), top_scores[:, j].tolist()) for j in range(len(queries))]
 
-def lambda_handler(event, context):
-    try:
-        # Handle CORS preflight
-        if event.get('httpMethod') == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type'
-                },
-                'body': ''
-            }
-        
-        print(f"Event: {json.dumps(event)}")
-        body = json.loads(event.get('body', '{}')) if event.get('httpMethod') == 'POST' else event
-        action = body.get('action')
-        papers = load_papers()
-        
-        if action == 'explain_paper':
-            paper = papers[body.get('paper_index')]
-            prompt = f"Explain this research paper in simple, clear terms:\n\nTitle: {paper['title_clean']}\n\nAbstract: {paper.get('abstract', 'No abstract available')[:500]}\n\nProvide:\n1. Main idea (2-3 sentences)\n2. Key methods used\n3. Why it matters\n4. Who should read it\n\nKeep it concise and accessible."
-            explanation = call_gemini_api(prompt)
-            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'explanation': explanation, 'paper_title': paper['title_clean']})}
-        
-        elif action == 'compare_papers':
-            indices = body.get('paper_indices', [])
-            
-            papers_text = ""
-            for i, idx in enumerate(indices, 1):
-                paper = papers[idx]
-                papers_text += f"\n\nPaper {i}:\nTitle: {paper['title_clean']}\nAbstract: {paper.get('abstract', '')[:400]}"
-            
-            prompt = f"""Compare these {len(indices)} research papers:
+def _bitmap_ids(bitmap):
+    return np.frombuffer(bitmap.to_array(), dtype=np.uint32).astype(np.int32)
+
+def keyword_search(query, top_k=10):
+    query_words = [w for w in _tokenize(query) if len(w) > 2]
+    empty = np.empty(0, dtype=np.int32)
+    
+    # Score = 2 per query word found in the title, 1 if only in the abstract
+    n = paper_count
+    title_hits = []
+    abstract_hits = []
+    for w in query_words:
+        tokens = _matching_tokens(w)
+        in_title = BitMap().union(*(title_postings[t] for t in tokens if t in title_postings))
+        in_abstract = BitMap().union(*(abstract_postings[t] for t in tokens if t in abstract_postings))
+        title_hits.append(_bitmap_ids(in_title))
+        abstract_hits.append(_bitmap_ids(in_abstract - in_title))
+    scores = 2 * np.bincount(np.concatenate([empty] + title_hits), minlength=n)
+    scores += np.bincount(np.concatenate([empty] + abstract_hits), minlength=n)
+    
+    # Scores are small integers, so ties are common; sort all candidates by
+    # (-score, index) rather than argpartition, which cuts ties arbitrarily
+    candidates = np.flatnonzero(scores)
+    top = candidates[np.lexsort((candidates, -scores[candidates]))][:top_k]
+    
+    max_score = 2 * len(query_words) or 1
+    return top.tolist(), (scores[top] / max_score).tolist()
+
+def _response(status_code, payload):
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': orjson.dumps(payload).decode('utf-8')
+    }
+
+# Formatted title/abstract block for prompts; the same papers recur across
+# sessions, so keep the rendered text rather than rebuilding it each time
+@lru_cache(maxsize=4096)
+def _paper_block(idx, short=False):
+    abstract = _text_at(abstracts_short, idx) if short else _text_at(abstracts, idx)[:400]
+    return f"Title: {_text_at(titles, idx)}\nAbstract: {abstract}"
+
+def _valid_index(idx):
+    return isinstance(idx, int) and not isinstance(idx, bool) and 0 <= idx < paper_count
+
+def _explain_prompt(idx):
+    return f"Explain this research paper in simple, clear terms:\n\nTitle: {_text_at(titles, idx)}\n\nAbstract: {_text_at(abstracts, idx) or 'No abstract available'}\n\nProvide:\n1. Main idea (2-3 sentences)\n2. Key methods used\n3. Why it matters\n4. Who should read it\n\nKeep it concise and accessible."
+
+def _explain_paper(body):
+    idx = body.get('paper_index')
+    
+    if not _valid_index(idx):
+        return _response(400, {'error': f'paper_index must be an integer from 0 to {paper_count - 1}'})
+    
+    explanation = call_gemini_api(_explain_prompt(idx))
+    return _response(200, {'explanation': explanation, 'paper_title': _text_at(titles, idx)})
+
+def _compare_papers(body):
+    indices = body.get('paper_indices', [])
+    
+    if not isinstance(indices, list) or not all(_valid_index(idx) for idx in indices):
+        return _response(400, {'error': f'paper_indices must be integers from 0 to {paper_count - 1}'})
+    
+    papers_text = "".join(f"\n\nPaper {i}:\n{_paper_block(idx)}" for i, idx in enumerate(indices, 1))
+    
+    prompt = f"""Compare these {len(indices)} research papers:
 
         {papers_text}
 
@@ -162,49 +460,56 @@ def lambda_handler(event, context):
         5. **Reading Order** - In what order should someone read these papers?
 
         Make it clear and structured."""
-            
-            comparison = call_gemini_api(prompt)
-            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'comparison': comparison})}
-
-        elif action == 'rag_search':
-            query = body.get('query', '')
-            
-            if not query:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Query is required'})
-                }
-            
-            if 'relevant_papers' in body and body['relevant_papers']:
-                indices = body.get('relevant_papers', [])[:5]
-                scores = [1.0] * len(indices)
-            else:
-                print("Loading embeddings from S3...")
-                bucket = 'research-paper-rec'
-                embeddings_obj = s3.get_object(Bucket=bucket, Key='data/embeddings/paper_embeddings_10k.npy')
-                embeddings_bytes = BytesIO(embeddings_obj['Body'].read())
-                paper_embeddings = np.load(embeddings_bytes)
-                
-                print("Getting query embedding...")
-                query_embedding = get_embedding(query)
-                
-                print("Performing semantic search...")
-                indices, scores = semantic_search(query_embedding, paper_embeddings, top_k=10)
-            
-            if not indices:
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'answer': 'I couldn\'t find papers relevant to your question. Try different keywords!'})
-                }
-            
-            context = "\n---\n".join([
-                f"Paper {i+1} (Relevance: {scores[i]:.2f}):\nTitle: {papers[idx]['title_clean']}\nAbstract: {papers[idx].get('abstract', '')[:300]}"
-                for i, idx in enumerate(indices[:5])
-            ])
-            
-            prompt = f"""Based on these research papers:
+    
+    comparison = call_gemini_api(prompt)
+    return _response(200, {'comparison': comparison})
+
+def _rag_search(body):
+    query = body.get('query')
+    
+    if not isinstance(query, str) or not query.strip():
+        return _response(400, {'error': 'Query is required'})
+    query = query[:MAX_QUERY_CHARS]
+    
+    query_embedding = None
+    if 'relevant_papers' in body and body['relevant_papers']:
+        indices = body['relevant_papers']
+        if not isinstance(indices, list) or not all(_valid_index(idx) for idx in indices):
+            return _response(400, {'error': f'relevant_papers must be integers from 0 to {paper_count - 1}'})
+        indices = indices[:5]
+        scores = [1.0] * len(indices)
+        source = 'relevant_papers'
+    else:
+        print("Getting query embedding...")
+        try:
+            query_embedding = get_embedding(query).astype(np.float32)
+            query_embedding /= np.linalg.norm(query_embedding)
+        except Exception as e:
+            print(f"Embedding failed, falling back to keyword search: {e}")
+            query_embedding = None
+        
+        cached = _cache_get_similar(query_embedding) if query_embedding is not None else None
+        if cached is not None:
+            print("Answer cache hit (similar query)")
+            return _response(200, {'answer': cached[1], 'papers': cached[2]})
+        
+        if query_embedding is not None:
+            print("Performing semantic search...")
+            indices, scores = semantic_search(query_embedding, paper_embeddings, paper_scales, top_k=10)
+            source = 'semantic'
+        else:
+            indices, scores = keyword_search(query, top_k=10)
+            source = 'keyword'
+    
+    if not indices:
+        return _response(200, {'answer': 'I couldn\'t find papers relevant to your question. Try different keywords!'})
+    
+    context = "\n---\n".join([
+        f"Paper {i+1} (Relevance: {scores[i]:.2f}):\n{_paper_block(idx, short=True)}"
+        for i, idx in enumerate(indices[:5])
+    ])
+    
+    prompt = f"""Based on these research papers:
 
         {context}
 
@@ -217,30 +522,147 @@ def lambda_handler(event, context):
         4. Do NOT include any index numbers or paper IDs in your response
 
         Be helpful and informative!"""
-            
-            answer = call_gemini_api(prompt)
-            
-            paper_details = [
-                {
-                    'index': idx, 
-                    'title': papers[idx]['title_clean'],
-                    'score': float(scores[i])
-                }
-                for i, idx in enumerate(indices[:5])
+    
+    key = _cache_key(query, source, indices[:5])
+    cached = _cache_get(key)
+    if cached is not None:
+        print("Answer cache hit")
+        answer = cached[1]
+    else:
+        answer = call_gemini_api(prompt)
+    
+    paper_details = [
+        {
+            'index': idx, 
+            'title': _text_at(titles, idx),
+            'score': float(scores[i])
+        }
+        for i, idx in enumerate(indices[:5])
+    ]
+    _cache_put(key, query_embedding, answer, paper_details)
+    
+    return _response(200, {'answer': answer, 'papers': paper_details})
+
+def _batch_explain(body):
+    indices = body.get('paper_indices', [])
+    
+    if not isinstance(indices, list) or not indices:
+        return _response(400, {'error': 'paper_indices is required'})
+    if not all(_valid_index(idx) for idx in indices):
+        return _response(400, {'error': f'paper_indices must be integers from 0 to {paper_count - 1}'})
+    
+    # Each key must be unique within a batch, and duplicates would be billed twice
+    indices = list(dict.fromkeys(indices))
+    if len(indices) > MAX_BATCH_PAPERS:
+        return _response(400, {'error': f'At most {MAX_BATCH_PAPERS} papers per batch'})
+    
+    batch_name = create_gemini_batch(EXPLAIN_BATCH_DISPLAY_NAME, [(f"p_{idx}", _explain_prompt(idx)) for idx in indices])
+    return _response(200, {'batch_name': batch_name})
+
+# (paper index, value) for each p_<index> key naming a paper in this corpus;
+# anything else can't have come from batch_explain and is skipped
+def _explain_batch_items(keyed):
+    for key, value in keyed.items():
+        match = EXPLAIN_BATCH_KEY_RE.fullmatch(key)
+        if match and _valid_index(int(match.group(1))):
+            yield int(match.group(1)), value
+
+def _get_batch(body):
+    batch_name = body.get('batch_name')
+    
+    if not isinstance(batch_name, str) or not BATCH_NAME_RE.fullmatch(batch_name):
+        return _response(400, {'error': 'batch_name must be a batch name returned by batch_explain'})
+    
+    display_name, state, results, errors = get_gemini_batch(batch_name)
+    
+    if display_name != EXPLAIN_BATCH_DISPLAY_NAME:
+        return _response(400, {'error': 'batch_name must be a batch name returned by batch_explain'})
+    
+    explanations = [
+        {
+            'paper_index': idx,
+            'paper_title': _text_at(titles, idx),
+            'explanation': text
+        }
+        for idx, text in _explain_batch_items(results)
+    ]
+    failed = [
+        {
+            'paper_index': idx,
+            'paper_title': _text_at(titles, idx),
+            'error': message
+        }
+        for idx, message in _explain_batch_items(errors)
+    ]
+    
+    return _response(200, {'state': state, 'explanations': explanations, 'failed': failed})
+
+def _search_papers(body):
+    queries = body.get('queries')
+    top_k = body.get('top_k', 10)
+    
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return _response(400, {'error': 'queries must be a non-empty list of strings'})
+    if len(queries) > MAX_BATCH_QUERIES:
+        return _response(400, {'error': f'At most {MAX_BATCH_QUERIES} queries per request'})
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_TOP_K:
+        return _response(400, {'error': f'top_k must be an integer from 1 to {MAX_TOP_K}'})
+    
+    queries = [q[:MAX_QUERY_CHARS] for q in queries]
+    
+    try:
+        query_embeddings = get_embedding(queries)
+    except Exception as e:
+        print(f"Embedding failed, falling back to keyword search: {e}")
+        query_embeddings = None
+    
+    if query_embeddings is not None:
+        results = semantic_search_batch(query_embeddings, paper_embeddings, paper_scales, top_k=top_k)
+    else:
+        results = [keyword_search(q, top_k=top_k) for q in queries]
+    
+    return _response(200, {'results': [
+        {
+            'query': query,
+            'papers': [
+                {'index': idx, 'title': _text_at(titles, idx), 'score': float(score)}
+                for idx, score in zip(indices, scores)
             ]
-            
+        }
+        for query, (indices, scores) in zip(queries, results)
+    ]})
+
+ACTIONS = {
+    'explain_paper': _explain_paper,
+    'compare_papers': _compare_papers,
+    'rag_search': _rag_search,
+    'batch_explain': _batch_explain,
+    'get_batch': _get_batch,
+    'search_papers': _search_papers,
+}
+
+def lambda_handler(event, context):
+    try:
+        # Handle CORS preflight
+        if event.get('httpMethod') == 'OPTIONS':
             return {
                 'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'answer': answer,
-                    'papers': paper_details
-                })
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type'
+                },
+                'body': ''
             }
         
-        return {'statusCode': 400, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': 'Invalid action'})}
+        print(f"Event: {orjson.dumps(event).decode('utf-8')}")
+        body = orjson.loads(event.get('body') or '{}') if event.get('httpMethod') == 'POST' else event
+        
+        handler = ACTIONS.get(body.get('action'))
+        if handler is None:
+            return _response(400, {'error': 'Invalid action'})
+        return handler(body)
     except Exception as e:
-        import traceback
         print(f"Error: {e}")
         print(traceback.format_exc())
-        return {'statusCode': 500, 'headers': {'Access-Control-Allow-Origin': '*'}, 'body': json.dumps({'error': str(e)})}
\ No newline at end of file
+        return _response(500, {'error': str(e)})